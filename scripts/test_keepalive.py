@@ -1,30 +1,40 @@
+import re
 import socket
 
+CONTENT_LENGTH_RE = re.compile(rb"\r\nContent-Length:[ \t]*(\d+)[ \t]*(?:\r\n|$)", re.IGNORECASE)
+HAS_QUICKACK = hasattr(socket, "TCP_QUICKACK")
+
+
+def set_quickack(sock):
+    # Linux falls back to delayed ACKs after each receive, so re-arm per read
+    if HAS_QUICKACK:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
 
 def read_until(sock, marker, timeout=2.0):
     sock.settimeout(timeout)
-    data = b""
-    while marker not in data:
+    data = bytearray()
+    while True:
         chunk = sock.recv(4096)
         if not chunk:
             return None
+        # Only rescan the tail that could complete a marker split across reads
+        start = max(0, len(data) - len(marker) + 1)
         data += chunk
-    return data
+        if data.find(marker, start) >= 0:
+            set_quickack(sock)
+            return data
 
 
 def parse_content_length(headers_blob):
-    for line in headers_blob.split(b"\r\n"):
-        if line.lower().startswith(b"content-length:"):
-            try:
-                return int(line.split(b":", 1)[1].strip())
-            except ValueError:
-                return None
-    return None
+    match = CONTENT_LENGTH_RE.search(headers_blob)
+    return int(match.group(1)) if match else None
 
 
 def make_request(host="127.0.0.1", port=8080, count=5):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    set_quickack(sock)
     sock.settimeout(2.0)
     sock.connect((host, port))
 
@@ -19,79 +19,248 @@ The test passes if:
 """
 
 import argparse
-import http.client
 import json
 import socket
 import threading
 import time
+from array import array
 from collections import Counter
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import List, Optional, Tuple
+
+REQUEST_TIMEOUT = 5.0
+# Requests a worker accumulates locally before publishing them to TestStats
+MERGE_INTERVAL = 1024
+HAS_QUICKACK = hasattr(socket, "TCP_QUICKACK")
+RESPONSE_BUFFER_SIZE = 65536
+STATUS_LINE_PREFIX = len(b"HTTP/1.1 200")
+
+# Prebuilt request; only the Host header is filled in per run
+REQUEST_TEMPLATE = (
+    b"POST /compute/sum HTTP/1.1\r\n"
+    b"Host: %s:%d\r\n"
+    b"Connection: close\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: 15\r\n"
+    b"\r\n"
+    b"[1.0, 2.0, 3.0]"
+)
+
+
+class LatencyHistogram:
+    """Fixed-size latency histogram with HdrHistogram-style buckets.
+
+    Values are tracked in microseconds. Below 2048us every value has its own
+    bucket; above that each power of two is split into 1024 buckets, which
+    keeps three significant digits up to 60s in ~140KB regardless of how many
+    samples are recorded.
+    """
+
+    SUB_BUCKET_BITS = 11
+    SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+    SUB_BUCKET_HALF = SUB_BUCKET_COUNT // 2
+    HIGHEST_TRACKABLE_US = 60_000_000
+
+    def __init__(self):
+        self.counts = array("Q", [0]) * (self._index(self.HIGHEST_TRACKABLE_US) + 1)
+        self.total = 0
+        self.sum_us = 0
+        self.max_us = 0
+
+    @classmethod
+    def _index(cls, value_us: int) -> int:
+        if value_us < cls.SUB_BUCKET_COUNT:
+            return value_us
+        shift = value_us.bit_length() - cls.SUB_BUCKET_BITS
+        return (
+            cls.SUB_BUCKET_COUNT
+            + (shift - 1) * cls.SUB_BUCKET_HALF
+            + (value_us >> shift)
+            - cls.SUB_BUCKET_HALF
+        )
+
+    @classmethod
+    def _highest_equivalent(cls, index: int) -> int:
+        if index < cls.SUB_BUCKET_COUNT:
+            return index
+        shift, offset = divmod(index - cls.SUB_BUCKET_COUNT, cls.SUB_BUCKET_HALF)
+        return ((offset + cls.SUB_BUCKET_HALF + 1) << (shift + 1)) - 1
+
+    def record(self, latency_ms: float):
+        value_us = min(int(latency_ms * 1000), self.HIGHEST_TRACKABLE_US)
+        self.counts[self._index(value_us)] += 1
+        self.total += 1
+        self.sum_us += value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def add(self, other: "LatencyHistogram"):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum_us += other.sum_us
+        self.max_us = max(self.max_us, other.max_us)
+
+    def mean_ms(self) -> float:
+        return self.sum_us / self.total / 1000 if self.total else 0.0
+
+    def max_ms(self) -> float:
+        return self.max_us / 1000
+
+    def value_at_percentile_ms(self, percentile: float) -> float:
+        target = max(1, -(-self.total * percentile // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max_us) / 1000
+        return self.max_ms()
 
 
 @dataclass
 class TestStats:
-    """Thread-safe test statistics."""
+    """Test statistics, merged from per-worker results."""
     lock: threading.Lock = field(default_factory=threading.Lock)
     success: int = 0
     errors: Counter = field(default_factory=Counter)
-    latencies: list = field(default_factory=list)
+    latencies: LatencyHistogram = field(default_factory=LatencyHistogram)
+    unfinished_workers: int = 0
 
-    def record_success(self, latency_ms: float):
+    def merge(self, success: int, errors: Counter, latencies: LatencyHistogram):
         with self.lock:
-            self.success += 1
-            self.latencies.append(latency_ms)
+            self.success += success
+            self.errors.update(errors)
+            self.latencies.add(latencies)
 
-    def record_error(self, error_type: str):
+    def snapshot(self) -> "TestStats":
+        """Copy the merged results so late workers cannot change them mid-report."""
         with self.lock:
-            self.errors[error_type] += 1
-
-
-def make_request(host: str, port: int, stats: TestStats) -> bool:
-    """Make a single POST request with Connection: close."""
+            latencies = LatencyHistogram()
+            latencies.add(self.latencies)
+            return TestStats(
+                success=self.success,
+                errors=Counter(self.errors),
+                latencies=latencies,
+                unfinished_workers=self.unfinished_workers,
+            )
+
+
+def connect_any(addresses: List[Tuple[int, tuple]]) -> socket.socket:
+    """Connect to the first reachable address, like socket.create_connection.
+
+    The address that connected is moved to the front of the worker's list so
+    later requests try it first. Raises the last error if none connect.
+    """
+    error: Optional[OSError] = None
+    for index, (family, address) in enumerate(addresses):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if HAS_QUICKACK:
+                # Keep delayed ACKs out of the measured latency
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            sock.settimeout(REQUEST_TIMEOUT)
+            sock.connect(address)
+        except OSError as e:
+            sock.close()
+            error = e
+            continue
+        if index:
+            addresses.insert(0, addresses.pop(index))
+        return sock
+    raise error
+
+
+def make_request(
+    addresses: List[Tuple[int, tuple]], request: bytes, buffer: memoryview
+) -> Tuple[Optional[str], float]:
+    """Make a single POST request with Connection: close.
+
+    The response is read into the caller's reusable buffer until the server
+    closes the connection. Only the status line prefix is kept; later reads
+    overwrite the rest of the buffer. Returns the error type (None on success)
+    and the latency in milliseconds.
+    """
     start = time.monotonic()
     try:
-        conn = http.client.HTTPConnection(host, port, timeout=5)
-        headers = {
-            "Connection": "close",
-            "Content-Type": "application/json"
-        }
-        body = "[1.0, 2.0, 3.0]"
-        conn.request("POST", "/compute/sum", body, headers)
-        response = conn.getresponse()
-        response.read()  # Consume the body
-        conn.close()
+        with connect_any(addresses) as sock:
+            sock.sendall(request)
+            received = 0
+            while True:
+                n = sock.recv_into(buffer[min(received, STATUS_LINE_PREFIX):])
+                if not n:
+                    break
+                received += n
 
         latency_ms = (time.monotonic() - start) * 1000
-        if response.status == 200:
-            stats.record_success(latency_ms)
-            return True
+        if not received:
+            # Same classification http.client used (RemoteDisconnected)
+            return "ECONNRESET", latency_ms
+        status = bytes(buffer[9:STATUS_LINE_PREFIX]) if received >= STATUS_LINE_PREFIX else b""
+        if status == b"200":
+            return None, latency_ms
+        elif status.isdigit():
+            return f"status_{status.decode()}", latency_ms
         else:
-            stats.record_error(f"status_{response.status}")
-            return False
+            return "other_BadStatusLine", latency_ms
 
     except ConnectionRefusedError:
-        stats.record_error("ECONNREFUSED")
-        return False
+        error = "ECONNREFUSED"
     except ConnectionResetError:
-        stats.record_error("ECONNRESET")
-        return False
+        error = "ECONNRESET"
     except socket.timeout:
-        stats.record_error("timeout")
-        return False
+        error = "timeout"
     except OSError as e:
-        stats.record_error(f"OSError_{e.errno}")
-        return False
+        error = f"OSError_{e.errno}"
     except Exception as e:
-        stats.record_error(f"other_{type(e).__name__}")
-        return False
+        error = f"other_{type(e).__name__}"
+    return error, (time.monotonic() - start) * 1000
 
 
 def worker_loop(host: str, port: int, stats: TestStats, stop_event: threading.Event):
-    """Worker that continuously makes requests until stopped."""
+    """Worker that continuously makes requests until stopped.
+
+    Counters stay local to the thread and are merged into stats every
+    MERGE_INTERVAL requests and on exit, so workers rarely contend on the
+    shared lock and a worker stuck past the join timeout loses at most one
+    interval of results.
+    """
+    host_header = f"[{host}]" if ":" in host else host
+    request = REQUEST_TEMPLATE % (host_header.encode(), port)
+    buffer = memoryview(bytearray(RESPONSE_BUFFER_SIZE))
+    addresses: List[Tuple[int, tuple]] = []
+    success = 0
+    errors: Counter = Counter()
+    latencies = LatencyHistogram()
+    pending = 0
     while not stop_event.is_set():
-        make_request(host, port, stats)
+        if not addresses:
+            # Resolved once per worker; every result is kept so a host that
+            # lists ::1 before 127.0.0.1 still reaches an IPv4-only server.
+            # A failed lookup counts as an error and is retried next iteration.
+            try:
+                addresses = [
+                    (family, address)
+                    for family, _, _, _, address in socket.getaddrinfo(
+                        host, port, type=socket.SOCK_STREAM
+                    )
+                ]
+            except OSError as e:
+                errors[f"OSError_{e.errno}"] += 1
+                continue
+        error, latency_ms = make_request(addresses, request, buffer)
+        if error is None:
+            success += 1
+            latencies.record(latency_ms)
+        else:
+            errors[error] += 1
+        pending += 1
+        if pending >= MERGE_INTERVAL:
+            stats.merge(success, errors, latencies)
+            success, errors, latencies, pending = 0, Counter(), LatencyHistogram(), 0
+    stats.merge(success, errors, latencies)
 
 
 def run_test(host: str, port: int, threads: int, duration: float) -> TestStats:
@@ -118,12 +287,15 @@ def run_test(host: str, port: int, threads: int, duration: float) -> TestStats:
     except KeyboardInterrupt:
         print("\nInterrupted by user")
 
-    # Signal stop and wait
+    # Signal stop and wait; workers publish their results on exit, so allow
+    # an in-flight request to run into its timeout
     stop_event.set()
     for t in workers:
-        t.join(timeout=1.0)
+        t.join(timeout=REQUEST_TIMEOUT + 1.0)
+    with stats.lock:
+        stats.unfinished_workers = sum(t.is_alive() for t in workers)
 
-    return stats
+    return stats.snapshot()
 
 
 def print_results(stats: TestStats, duration: float):
@@ -140,14 +312,16 @@ def print_results(stats: TestStats, duration: float):
     print(f"Successful:        {stats.success}")
     print(f"Errors:            {error_count} ({error_rate:.2f}%)")
     print(f"Throughput:        {total / duration:.2f} req/s")
+    if stats.unfinished_workers:
+        print(f"Unfinished:        {stats.unfinished_workers} worker(s) still running; "
+              f"their last unmerged requests are not counted")
 
-    if stats.latencies:
-        latencies = sorted(stats.latencies)
+    if stats.latencies.total:
         print(f"\nLatency (ms):")
-        print(f"  avg:  {sum(latencies) / len(latencies):.2f}")
-        print(f"  p50:  {latencies[len(latencies) // 2]:.2f}")
-        print(f"  p99:  {latencies[int(len(latencies) * 0.99)]:.2f}")
-        print(f"  max:  {max(latencies):.2f}")
+        print(f"  avg:  {stats.latencies.mean_ms():.2f}")
+        print(f"  p50:  {stats.latencies.value_at_percentile_ms(50):.2f}")
+        print(f"  p99:  {stats.latencies.value_at_percentile_ms(99):.2f}")
+        print(f"  max:  {stats.latencies.max_ms():.2f}")
 
     if stats.errors:
         print(f"\nErrors by type:")